@@ -1,20 +1,32 @@
 import asyncio
+import contextvars
+import hashlib
+import json
 import os
 import logging
+import socket
 import time
+from dataclasses import dataclass
 import httpx
 from jinja2 import Environment, FileSystemLoader
-from kubernetes import client, config as k8s_config
+from kubernetes import client, config as k8s_config, watch
+from kubernetes.client.rest import ApiException
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("controller")
 
 INTERVAL = int(os.getenv("INTERVAL", "10"))
 TIMEOUT = int(os.getenv("TIMEOUT", "2"))
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "64"))
+ZONE_WRITE_CONCURRENCY = 8
+RESOLVE_CACHE_TTL = 60
+PROBE_CACHE_IDLE = 300
+UNHEALTHY_LOG_SAMPLE = 10
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
 COREFILE_PATH = "/etc/coredns/Corefile"
 ZONEFILE_DIR = "/etc/coredns/zones"
+SERIAL_PATH = "/etc/coredns/serials.json"
 GEOIP_DBPATH = "/data/GeoLite2-City.mmdb"
 GEOIP_ENABLED = os.getenv("GEOIP", "false").lower() == "true"
 
@@ -33,41 +45,246 @@ except Exception:
 
 
 custom_api = client.CustomObjectsApi()
+check_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+zone_write_semaphore = asyncio.Semaphore(ZONE_WRITE_CONCURRENCY)
+
+CRD_GROUP = "cyberun.cloud"
+CRD_VERSION = "v1"
+CRD_PLURAL = "gslbconfigs"
+WATCH_TIMEOUT = 300
+WATCH_CONNECT_TIMEOUT = 10
+WATCH_READ_SLACK = 30
+HTTP_STATUS_GONE = 410
+LIST_PAGE_SIZE = 500
+
+_CRD_CACHE: dict[str, dict] = {}
+_CRD_SYNCED = asyncio.Event()
+_active_watch: watch.Watch | None = None
+
+
+def _crd_key(item: dict) -> str:
+    metadata = item.get("metadata", {})
+    return f"{metadata.get('namespace')}/{metadata.get('name')}"
+
+
+async def list_domain_configs() -> str | None:
+    items = {}
+    resource_version = None
+    page = {"resource_version": "0"}
+    while True:
+        ret = await asyncio.to_thread(
+            custom_api.list_cluster_custom_object,
+            group=CRD_GROUP,
+            version=CRD_VERSION,
+            plural=CRD_PLURAL,
+            limit=LIST_PAGE_SIZE,
+            **page,
+        )
+        for item in ret.get("items", []):
+            items[_crd_key(item)] = item
 
+        metadata = ret.get("metadata", {})
+        resource_version = metadata.get("resourceVersion") or resource_version
+        cont = metadata.get("continue")
+        if not cont:
+            break
+        page = {"_continue": cont}
 
-async def get_domain_configs():
-    domain_map = {}
+    for key in list(_CRD_CACHE):
+        if key not in items:
+            _CRD_CACHE.pop(key, None)
+    _CRD_CACHE.update(items)
+
+    return resource_version
+
+
+def _watch_gslbconfigs(resource_version: str | None) -> str | None:
+    global _active_watch
+    w = watch.Watch()
+    _active_watch = w
+    try:
+        for event in w.stream(
+            custom_api.list_cluster_custom_object,
+            group=CRD_GROUP,
+            version=CRD_VERSION,
+            plural=CRD_PLURAL,
+            resource_version=resource_version,
+            timeout_seconds=WATCH_TIMEOUT,
+            _request_timeout=(WATCH_CONNECT_TIMEOUT, WATCH_TIMEOUT + WATCH_READ_SLACK),
+            allow_watch_bookmarks=True,
+        ):
+            event_type = event["type"]
+            item = event["raw_object"]
+            resource_version = (
+                item.get("metadata", {}).get("resourceVersion") or resource_version
+            )
+            if event_type == "BOOKMARK":
+                continue
+
+            key = _crd_key(item)
+            if event_type in ("ADDED", "MODIFIED"):
+                _CRD_CACHE[key] = item
+            elif event_type == "DELETED":
+                _CRD_CACHE.pop(key, None)
+    finally:
+        _active_watch = None
+
+    return resource_version
+
+
+async def watch_domain_configs():
+    resource_version = None
+    while True:
+        try:
+            if resource_version is None:
+                resource_version = await list_domain_configs()
+                _CRD_SYNCED.set()
+            resource_version = await asyncio.to_thread(
+                _watch_gslbconfigs, resource_version
+            )
+        except ApiException as e:
+            resource_version = None
+            if e.status == HTTP_STATUS_GONE:
+                logger.info("CRD watch resourceVersion expired, re-listing.")
+                continue
+            logger.error(f"Failed to watch CRDs, re-listing: {e}")
+            await asyncio.sleep(INTERVAL)
+        except Exception as e:
+            logger.error(f"Failed to watch CRDs, re-listing: {e}")
+            resource_version = None
+            await asyncio.sleep(INTERVAL)
+
+
+@dataclass(frozen=True, slots=True)
+class Target:
+    address: str
+    port: int
+    path: str
+    protocol: str
+    location: str
+    weight: int
+
+
+def parse_target(raw: dict) -> Target | None:
+    address = raw.get("address")
+    if not address:
+        return None
     try:
-        ret = custom_api.list_cluster_custom_object(
-            group="cyberun.cloud", version="v1", plural="gslbconfigs"
+        return Target(
+            address=address,
+            port=int(raw.get("port", 80)),
+            path=raw.get("path", "/"),
+            protocol=raw.get("protocol", "http").lower(),
+            location=(raw.get("location") or "").upper(),
+            weight=int(raw.get("weight", 1)),
         )
-        for item in ret.get("items", []):
+    except (TypeError, ValueError, AttributeError) as e:
+        logger.warning(f"Invalid target {raw}: {e}")
+        return None
+
+
+def parse_records(records: list) -> list:
+    parsed = []
+    for rec in records:
+        targets = []
+        for raw in rec.get("targets", []):
+            target = parse_target(raw)
+            if target is not None:
+                targets.append(target)
+        parsed.append({"name": rec.get("name"), "targets": targets})
+    return parsed
+
+
+async def get_domain_configs():
+    await _CRD_SYNCED.wait()
+
+    domain_map = {}
+    for key, item in list(_CRD_CACHE.items()):
+        try:
             spec = item.get("spec", {})
             domain = spec.get("domain")
             nameservers = spec.get("nameservers")
             if not domain or not nameservers:
                 continue
 
+            records = parse_records(spec.get("records", []))
             if domain not in domain_map:
                 domain_map[domain] = {
                     "nameservers": nameservers,
                     "raw_records": [],
                 }
-            records = spec.get("records", [])
             domain_map[domain]["raw_records"].extend(records)
-    except Exception as e:
-        logger.error(f"Failed to fetch CRDs: {e}")
+        except Exception as e:
+            logger.error(f"Failed to read CRD {key}: {e}")
     return domain_map
 
 
+_unhealthy_targets: contextvars.ContextVar[list | None] = contextvars.ContextVar(
+    "unhealthy_targets", default=None
+)
+_RESOLVE_CACHE: dict[tuple[str, int], tuple[list[tuple[int, tuple]], float]] = {}
+_URL_CACHE: dict[tuple, tuple[httpx.URL, float]] = {}
+
+
+async def resolve_address(address: str, port: int) -> list[tuple[int, tuple]]:
+    key = (address, port)
+    now = time.monotonic()
+    cached = _RESOLVE_CACHE.get(key)
+    if cached is not None and now - cached[1] < RESOLVE_CACHE_TTL:
+        return cached[0]
+
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        address, port, type=socket.SOCK_STREAM
+    )
+    addrs = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+
+    _RESOLVE_CACHE[key] = (addrs, now)
+    return addrs
+
+
+def get_url(scheme: str, address: str, port: int, path: str) -> httpx.URL:
+    key = (scheme, address, port, path)
+    now = time.monotonic()
+    cached = _URL_CACHE.get(key)
+    if cached is not None:
+        url = cached[0]
+    else:
+        url = httpx.URL(f"{scheme}://{address}:{port}{path}")
+    _URL_CACHE[key] = (url, now)
+    return url
+
+
+def sweep_probe_caches():
+    now = time.monotonic()
+    for key, (_, resolved_at) in list(_RESOLVE_CACHE.items()):
+        if now - resolved_at >= RESOLVE_CACHE_TTL:
+            del _RESOLVE_CACHE[key]
+    for key, (_, last_used) in list(_URL_CACHE.items()):
+        if now - last_used >= PROBE_CACHE_IDLE:
+            del _URL_CACHE[key]
+
+
+async def _connect_any(address: str, port: int) -> bool:
+    loop = asyncio.get_running_loop()
+    for family, sockaddr in await resolve_address(address, port):
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError:
+            continue
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, sockaddr)
+            return True
+        except OSError:
+            continue
+        finally:
+            sock.close()
+    return False
+
+
 async def check_tcp(address: str, port: int) -> bool:
     try:
-        _, writer = await asyncio.wait_for(
-            asyncio.open_connection(address, port), timeout=TIMEOUT
-        )
-        writer.close()
-        await writer.wait_closed()
-        return True
+        return await asyncio.wait_for(_connect_any(address, int(port)), TIMEOUT)
     except Exception:
         return False
 
@@ -75,22 +292,19 @@ async def check_tcp(address: str, port: int) -> bool:
 async def check_http(
     client: httpx.AsyncClient, address: str, port: int, path: str, scheme: str = "http"
 ) -> bool:
-    url = f"{scheme}://{address}:{port}{path}"
     try:
-        resp = await client.get(url, timeout=TIMEOUT, follow_redirects=True)
+        url = get_url(scheme, address, port, path)
+        resp = await client.get(url, follow_redirects=True)
         return 200 <= resp.status_code < 300
     except Exception:
         return False
 
 
-async def verify_target(client: httpx.AsyncClient, target: dict) -> bool:
-    address = target.get("address")
-    if not address:
-        return False
-
-    protocol = target.get("protocol", "http").lower()
-    port = target.get("port", 80)
-    path = target.get("path", "/")
+async def verify_target(client: httpx.AsyncClient, target: Target) -> bool:
+    address = target.address
+    protocol = target.protocol
+    port = target.port
+    path = target.path
 
     is_healthy = False
     if protocol == "tcp":
@@ -101,15 +315,57 @@ async def verify_target(client: httpx.AsyncClient, target: dict) -> bool:
         logger.warning(f"Unknown protocol: {protocol}, marking as unhealthy.")
 
     if not is_healthy:
-        loc = target.get("location", "default")
-        logger.warning(f"Unhealthy: {protocol}://{address}:{port}{path} (Loc: {loc})")
+        record_unhealthy(target)
 
     return is_healthy
 
 
-async def resolve_healthy_records(client: httpx.AsyncClient, raw_records: list) -> dict:
+def record_unhealthy(target: Target):
+    loc = target.location or "default"
+    entry = (target.protocol, target.address, target.port, target.path, loc)
+    unhealthy = _unhealthy_targets.get()
+    if unhealthy is not None:
+        unhealthy.append(entry)
+    else:
+        logger.warning("Unhealthy: %s://%s:%s%s (Loc: %s)", *entry)
+
+
+def log_unhealthy_targets(unhealthy: list):
+    if not unhealthy:
+        return
+    sample = ", ".join(
+        f"{protocol}://{address}:{port}{path} (Loc: {loc})"
+        for protocol, address, port, path, loc in unhealthy[:UNHEALTHY_LOG_SAMPLE]
+    )
+    if len(unhealthy) > UNHEALTHY_LOG_SAMPLE:
+        sample += f", ... (+{len(unhealthy) - UNHEALTHY_LOG_SAMPLE} more)"
+    logger.warning("Unhealthy targets (%d): %s", len(unhealthy), sample)
+
+
+async def guarded_verify_target(client: httpx.AsyncClient, target: Target) -> bool:
+    async with check_semaphore:
+        try:
+            return await asyncio.wait_for(
+                verify_target(client, target), timeout=TIMEOUT + 1
+            )
+        except asyncio.TimeoutError:
+            record_unhealthy(target)
+            return False
+
+
+def probe_key(target: Target) -> tuple:
+    path = target.path if target.protocol != "tcp" else None
+    return (target.protocol, target.address, target.port, path)
+
+
+async def resolve_healthy_records(
+    client: httpx.AsyncClient, raw_records: list, probe_cache: dict | None = None
+) -> dict:
+    if probe_cache is None:
+        probe_cache = {}
+
     healthy_map = {}
-    check_tasks = []
+    check_tasks = {}
     metadata_list = []
 
     for rec in raw_records:
@@ -121,16 +377,26 @@ async def resolve_healthy_records(client: httpx.AsyncClient, raw_records: list)
 
         candidates = rec.get("targets", [])
         for target in candidates:
-            check_tasks.append(verify_target(client, target))
-            metadata_list.append((name, target))
+            key = probe_key(target)
+            if key not in probe_cache:
+                probe_cache[key] = asyncio.create_task(
+                    guarded_verify_target(client, target)
+                )
+            check_tasks[key] = probe_cache[key]
+            metadata_list.append((name, target, key))
 
     if not check_tasks:
         return healthy_map
 
-    results = await asyncio.gather(*check_tasks)
+    results = await asyncio.gather(*check_tasks.values(), return_exceptions=True)
+    outcomes = dict(zip(check_tasks, results))
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        logger.error(f"{len(errors)} health check(s) raised, e.g.: {errors[0]!r}")
 
-    for (name, target), is_healthy in zip(metadata_list, results):
-        if is_healthy:
+    for name, target, key in metadata_list:
+        if outcomes[key] is True:
             healthy_map[name].append(target)
 
     return healthy_map
@@ -139,132 +405,266 @@ async def resolve_healthy_records(client: httpx.AsyncClient, raw_records: list)
 def organize_data_by_region(healthy_map: dict) -> dict:
     zone_views = {"default": {}}
 
-    all_regions = set()
     for rec_name, targets in healthy_map.items():
         for t in targets:
-            loc = t.get("location")
-            if loc:
-                all_regions.add(loc.upper())
+            view = zone_views.setdefault(t.location or "default", {})
+            if t.weight > 0:
+                view.setdefault(rec_name, []).extend([t] * t.weight)
 
-    for rec_name, targets in healthy_map.items():
-        default_targets = []
-        for t in targets:
-            if not t.get("location"):
-                weight = t.get("weight", 1)
-                for _ in range(weight):
-                    default_targets.append(t)
+    if len(zone_views) == 1:
+        return zone_views
+
+    default_view = zone_views["default"]
+    for view_name, view in zone_views.items():
+        if view_name == "default":
+            continue
+        for rec_name, default_targets in default_view.items():
+            view.setdefault(rec_name, default_targets)
 
-        if default_targets:
-            zone_views["default"][rec_name] = default_targets
+    return zone_views
 
-    for region in all_regions:
-        zone_views[region] = {}
 
-        for rec_name, targets in healthy_map.items():
-            region_targets = []
+def _atomic_write(path: str, data: bytes, sync: bool = False):
+    temp_path = path + ".tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+        if sync:
+            os.fdatasync(fd)
+    finally:
+        os.close(fd)
+    os.replace(temp_path, path)
 
-            for t in targets:
-                if t.get("location", "").upper() == region:
-                    weight = t.get("weight", 1)
-                    for _ in range(weight):
-                        region_targets.append(t)
 
-            if not region_targets:
-                if rec_name in zone_views["default"]:
-                    region_targets = zone_views["default"][rec_name]
+_LAST_META: dict | None = None
 
-            if region_targets:
-                zone_views[region][rec_name] = region_targets
 
-    return zone_views
+def _sync_corefile(content: bytes) -> bool:
+    try:
+        with open(COREFILE_PATH, "rb") as f:
+            current = f.read()
+    except FileNotFoundError:
+        current = b""
+
+    if content == current:
+        return False
+    _atomic_write(COREFILE_PATH, content, sync=True)
+    return True
 
 
 async def update_corefile(domain_meta: dict):
+    global _LAST_META
+    if domain_meta == _LAST_META:
+        return
+
     try:
         content = corefile_template.render(
             geoip_enabled=GEOIP_ENABLED,
             geoip_dbpath=GEOIP_DBPATH,
             domain_meta=domain_meta,
-        )
-
-        current = ""
-        if os.path.exists(COREFILE_PATH):
-            with open(COREFILE_PATH, "r") as f:
-                current = f.read()
+        ).encode("utf-8")
 
-        if content != current:
-            with open(COREFILE_PATH, "w") as f:
-                f.write(content)
+        if await asyncio.to_thread(_sync_corefile, content):
             logger.info("Corefile updated.")
+        _LAST_META = dict(domain_meta)
     except Exception as e:
         logger.error(f"Failed to update Corefile: {e}")
 
 
-async def run_loop():
-    logger.info("Starting SimpleGSLB Controller ...")
-    os.makedirs(ZONEFILE_DIR, exist_ok=True)
+_ZONE_KEYS: dict[str, bytes] = {}
+_LAST_VIEWS: dict[str, tuple[list, dict]] = {}
+_SERIAL: dict[str, int] = {}
 
-    async with httpx.AsyncClient(verify=False) as client:
-        while True:
-            start_time = asyncio.get_event_loop().time()
 
-            try:
-                domains_config = await get_domain_configs()
-                serial = int(time.time())
-
-                current_domain_meta = {}
+def load_zone_serials():
+    try:
+        with open(SERIAL_PATH, "rb") as f:
+            _SERIAL.update({k: int(v) for k, v in json.load(f).items()})
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to load zone serials: {e}")
 
-                for domain, data in domains_config.items():
-                    try:
-                        nameservers = data.get("nameservers", [])
-                        raw_recs = data.get("raw_records", [])
 
-                        if not nameservers:
-                            logger.warning(
-                                f"Domain {domain} has no nameservers, skipping."
-                            )
-                            continue
+def save_zone_serials():
+    try:
+        _atomic_write(SERIAL_PATH, json.dumps(_SERIAL, sort_keys=True).encode("utf-8"))
+    except Exception as e:
+        logger.error(f"Failed to save zone serials: {e}")
+
+
+def prune_zone_state(domains_config: dict, domain_meta: dict) -> bool:
+    live_files = set()
+    for domain, regions in domain_meta.items():
+        live_files.add(f"db.{domain}.default")
+        live_files.update(f"db.{domain}.{region}" for region in regions)
+    # Domains that failed this tick keep their state until they are processed again.
+    kept_prefixes = tuple(
+        f"db.{domain}." for domain in domains_config if domain not in domain_meta
+    )
+
+    for domain in list(_LAST_VIEWS):
+        if domain not in domains_config:
+            del _LAST_VIEWS[domain]
+    for filename in list(_ZONE_KEYS):
+        if filename not in live_files and not filename.startswith(kept_prefixes):
+            del _ZONE_KEYS[filename]
+
+    pruned = False
+    for filename in list(_SERIAL):
+        if filename not in live_files and not filename.startswith(kept_prefixes):
+            del _SERIAL[filename]
+            pruned = True
+    return pruned
+
+
+def _render_and_write_zone(
+    domain: str, nameservers: list, serial: int, records: dict, zone_path: str
+):
+    content = zonefile_template.render(
+        domain=domain,
+        nameservers=nameservers,
+        serial=serial,
+        records=records,
+    ).encode("utf-8")
+    _atomic_write(zone_path, content)
+
+
+async def write_zone(
+    domain: str,
+    nameservers: list,
+    records: dict,
+    filename: str,
+    zone_key: bytes,
+) -> bool:
+    serial = max(_SERIAL.get(filename, 0) + 1, int(time.time()))
+    async with zone_write_semaphore:
+        try:
+            await asyncio.to_thread(
+                _render_and_write_zone,
+                domain,
+                nameservers,
+                serial,
+                records,
+                os.path.join(ZONEFILE_DIR, filename),
+            )
+            _ZONE_KEYS[filename] = zone_key
+            _SERIAL[filename] = serial
+            return True
+        except Exception as e:
+            logger.error(f"Failed to write zone file {filename}: {e}")
+            return False
 
-                        healthy_map = await resolve_healthy_records(client, raw_recs)
 
-                        views_data = organize_data_by_region(healthy_map)
+async def run_loop():
+    logger.info("Starting SimpleGSLB Controller ...")
+    os.makedirs(ZONEFILE_DIR, exist_ok=True)
+    load_zone_serials()
 
-                        active_regions = [
-                            r for r in views_data.keys() if r != "default"
-                        ]
-                        current_domain_meta[domain] = sorted(active_regions)
+    watcher = asyncio.create_task(watch_domain_configs())
 
-                        for view_name, records_in_view in views_data.items():
-                            filename = f"db.{domain}.{view_name}"
-                            try:
-                                content = zonefile_template.render(
-                                    domain=domain,
-                                    nameservers=nameservers,
-                                    serial=serial,
-                                    records=records_in_view,
+    try:
+        limits = httpx.Limits(
+            max_keepalive_connections=256, max_connections=512, keepalive_expiry=60.0
+        )
+        async with httpx.AsyncClient(
+            verify=False, limits=limits, timeout=httpx.Timeout(TIMEOUT)
+        ) as client:
+            loop = asyncio.get_running_loop()
+            next_tick = loop.time()
+            while True:
+                try:
+                    domains_config = await get_domain_configs()
+                    probe_cache = {}
+                    serials_changed = False
+                    unhealthy = []
+                    _unhealthy_targets.set(unhealthy)
+                    sweep_probe_caches()
+
+                    current_domain_meta = {}
+
+                    for domain, data in domains_config.items():
+                        try:
+                            nameservers = data.get("nameservers", [])
+                            raw_recs = data.get("raw_records", [])
+
+                            if not nameservers:
+                                logger.warning(
+                                    f"Domain {domain} has no nameservers, skipping."
                                 )
+                                continue
 
-                                zone_path = os.path.join(ZONEFILE_DIR, filename)
-                                temp_path = zone_path + ".tmp"
+                            healthy_map = await resolve_healthy_records(
+                                client, raw_recs, probe_cache
+                            )
 
-                                with open(temp_path, "w") as f:
-                                    f.write(content)
-                                os.rename(temp_path, zone_path)
-                            except Exception as e:
-                                logger.error(
-                                    f"Failed to write zone file {filename}: {e}"
+                            views_data = organize_data_by_region(healthy_map)
+
+                            active_regions = [
+                                r for r in views_data.keys() if r != "default"
+                            ]
+                            current_domain_meta[domain] = sorted(active_regions)
+
+                            if _LAST_VIEWS.get(domain) == (nameservers, views_data):
+                                continue
+
+                            write_tasks = []
+                            for view_name, records_in_view in views_data.items():
+                                filename = f"db.{domain}.{view_name}"
+                                zone_key = hashlib.blake2b(
+                                    repr(
+                                        (domain, nameservers, records_in_view)
+                                    ).encode()
+                                ).digest()
+                                if _ZONE_KEYS.get(filename) == zone_key:
+                                    continue
+
+                                write_tasks.append(
+                                    write_zone(
+                                        domain,
+                                        nameservers,
+                                        records_in_view,
+                                        filename,
+                                        zone_key,
+                                    )
                                 )
 
-                    except Exception as domain_e:
-                        logger.error(f"Error processing domain {domain}: {domain_e}")
-
-                await update_corefile(current_domain_meta)
-
-            except Exception as e:
-                logger.error(f"Error in run loop: {e}")
+                            results = await asyncio.gather(
+                                *write_tasks, return_exceptions=True
+                            )
+                            if any(r is True for r in results):
+                                serials_changed = True
+                            if all(r is True for r in results):
+                                _LAST_VIEWS[domain] = (nameservers, views_data)
+                            else:
+                                _LAST_VIEWS.pop(domain, None)
+
+                        except Exception as domain_e:
+                            logger.error(
+                                f"Error processing domain {domain}: {domain_e}"
+                            )
 
-            elapsed = asyncio.get_event_loop().time() - start_time
-            await asyncio.sleep(max(0, INTERVAL - elapsed))
+                    if prune_zone_state(domains_config, current_domain_meta):
+                        serials_changed = True
+                    if serials_changed:
+                        await asyncio.to_thread(save_zone_serials)
+                    log_unhealthy_targets(unhealthy)
+                    await update_corefile(current_domain_meta)
+
+                except Exception as e:
+                    logger.error(f"Error in run loop: {e}")
+
+                next_tick += INTERVAL
+                now = loop.time()
+                if next_tick < now:
+                    next_tick = now + INTERVAL
+                await asyncio.sleep(next_tick - now)
+    finally:
+        if _active_watch is not None:
+            _active_watch.stop()
+        watcher.cancel()
 
 
 def run():